@@ -1,20 +1,25 @@
 import os
+import re
 import shutil
+import stat
 import sys
-from distutils.util import (
-    strtobool,
-)
-from importlib import (
-    import_module,
-)
 from os import (
     path,
 )
 from pathlib import (
     Path,
 )
+from typing import (
+    Callable,
+    Dict,
+    Optional,
+    Tuple,
+)
 
 import django
+from django.apps import (
+    apps,
+)
 from django.conf import (
     settings,
 )
@@ -30,21 +35,19 @@ from django.core.management.utils import (
 from django.template import (
     Context,
     Engine,
+    Template,
 )
 from django.utils.version import (
     get_docs_version,
 )
-from isort.api import (
-    sort_code_string,
-)
-from isort.settings import (
-    DEFAULT_CONFIG,
-)
 
 import function_tools
 from function_tools.management.consts import (
     PARAMETERS_DIALOG_WINDOW,
 )
+from function_tools.management.renderers import (
+    specialize_template,
+)
 from function_tools.management.storages import (
     ImplementationStrategyStorage,
 )
@@ -53,6 +56,32 @@ from function_tools.models import (
 )
 
 
+# Разобранные шаблоны файлов с временем их изменения и специализированными функциями рендеринга. Переиспользуются при
+# повторных запусках команды в рамках одного процесса
+_COMPILED_TEMPLATES: Dict[str, Tuple[int, Template, Optional[Callable[[dict], Optional[str]]]]] = {}
+
+# Строка с импортом
+_IMPORT_LINE_RE = re.compile(r'^\s*(?:from|import)\s', re.MULTILINE)
+
+# Таблица удаления подчеркиваний при формировании наименования в стиле CamelCase
+_DROP_UNDERSCORE_TABLE = str.maketrans('', '', '_')
+
+
+def strtobool(value: str) -> int:
+    """
+    Преобразование строкового представления логического значения в 1 или 0. Замена удаленной из Python 3.12
+    distutils.util.strtobool
+    """
+    value = value.lower()
+
+    if value in ('y', 'yes', 't', 'true', 'on', '1'):
+        return 1
+    elif value in ('n', 'no', 'f', 'false', 'off', '0'):
+        return 0
+    else:
+        raise ValueError(f'invalid truth value {value!r}')
+
+
 class PatchedTemplateCommand(TemplateCommand):
     """
     Пропатченная команда для создания пакетов по шаблону
@@ -79,9 +108,14 @@ class PatchedTemplateCommand(TemplateCommand):
         self.camel_case_value = None
         self.extra_files = None
         self.extensions = None
+        self.context_data = None
+        self.context = None
 
         self._top_dir_path = None
         self._python_path_value = None
+        self._template_suffixes = tuple(old_suffix for old_suffix, _ in self.rewrite_template_suffixes)
+        self._template_engine = None
+        self._isort_config = None
 
     def _get_conf_dir_parent_path(self):
         """
@@ -89,6 +123,35 @@ class PatchedTemplateCommand(TemplateCommand):
         """
         return django.__path__[0]
 
+    def _get_template_engine(self) -> Engine:
+        """
+        Возвращает движок шаблонов, создаваемый однократно для всех рендерящихся файлов
+        """
+        if self._template_engine is None:
+            self._template_engine = Engine()
+
+        return self._template_engine
+
+    def _compile_template(self, old_path) -> Tuple[Template, Optional[Callable[[dict], Optional[str]]]]:
+        """
+        Возвращает разобранный шаблон файла и специализированную функцию его рендеринга, если шаблон ее допускает.
+        Повторный разбор производится только при изменении файла
+        """
+        mtime = os.stat(old_path).st_mtime_ns
+
+        cached_template = _COMPILED_TEMPLATES.get(old_path)
+        if cached_template and cached_template[0] == mtime:
+            return cached_template[1:]
+
+        with open(old_path, 'r', encoding='utf-8') as template_file:
+            content = template_file.read()
+
+        template = self._get_template_engine().from_string(content)
+        specialized_render = specialize_template(template, old_path)
+        _COMPILED_TEMPLATES[old_path] = (mtime, template, specialized_render)
+
+        return template, specialized_render
+
     def _sort_imports(
         self,
         content: str,
@@ -96,9 +159,22 @@ class PatchedTemplateCommand(TemplateCommand):
         """
         Сортировка импортов при помощи isort
         """
+        # файлы без импортов не изменяются isort, если конфигурация не добавляет импорты. Конфигурация по умолчанию
+        # импорты не добавляет
+        is_imports_added = self._isort_config is not None and self._isort_config.add_imports
+        if not is_imports_added and not _IMPORT_LINE_RE.search(content):
+            return content
+
+        from isort.api import (
+            sort_code_string,
+        )
+        from isort.settings import (
+            DEFAULT_CONFIG,
+        )
+
         return sort_code_string(
             code=content,
-            config=getattr(settings, 'ISORT_CONFIG') or DEFAULT_CONFIG,
+            config=self._isort_config or DEFAULT_CONFIG,
         )
 
     def handle_template(self, template=None, subdir=None):
@@ -107,11 +183,9 @@ class PatchedTemplateCommand(TemplateCommand):
         """
         template_directory_path = None
 
-        for app_name in settings.INSTALLED_APPS:
-            app_module = import_module(app_name)
-            app_path = app_module.__path__
-
-            application_path = Path(app_path[0])
+        # реестр приложений уже содержит пути приложений, в том числе подключенных через AppConfig
+        for app_config in apps.get_app_configs():
+            application_path = Path(app_config.path)
 
             temp_template_directory_path = (
                 application_path / 'function_templates' / self.strategy.function_template_name
@@ -151,26 +225,38 @@ class PatchedTemplateCommand(TemplateCommand):
         Формирование пути создаваемого пакета для дальнейшего использования в генерируемых импортах
         """
         top_dir_path = self._top_dir_path
+        launch_dir_suffix = f'/{self.name}'
         paths = [
             path_item
             for path_item in sys.path
-            if path_item in top_dir_path
+            # пустая строка означает текущую директорию и не является префиксом пути
+            if path_item
+            and top_dir_path.startswith(path_item)
+            and top_dir_path[len(path_item):len(path_item) + 1] == '/'
             # при запуске через django-admin в Python path добавляется директория, из которой запускается команда, что
             # искажает полноценный путь
-            and f'{path_item}/{self.name}' != top_dir_path
+            and top_dir_path[len(path_item):] != launch_dir_suffix
         ]
 
-        max_sys_path = max(paths)
+        if not paths:
+            raise CommandError(f'\'{top_dir_path}\' is not located in any Python path directory')
+
+        max_sys_path = max(paths, key=len)
 
-        self._python_path_value = top_dir_path.split(f'{max_sys_path}/')[1]
+        self._python_path_value = top_dir_path[len(max_sys_path) + 1:]
 
         if '/' in self._python_path_value:
             self._python_path_value = self._python_path_value.replace('/', '.')
 
     def _prepare_extra_files(self, options):
-        self.extra_files = []
-        for file in options['files']:
-            self.extra_files.extend(map(lambda x: x.strip(), file.split(',')))
+        """
+        Подготовка имен дополнительных рендерящихся файлов
+        """
+        self.extra_files = frozenset(
+            filename.strip()
+            for files in options['files']
+            for filename in files.split(',')
+        )
 
     def _prepare_extensions(self, options):
         """
@@ -183,8 +269,9 @@ class PatchedTemplateCommand(TemplateCommand):
                 f'Rendering {self.app_or_project} template files with extensions: {", ".join(self.extensions)}\n'
             )
 
+            extra_files = ', '.join(sorted(self.extra_files))
             self.stdout.write(
-                f'Rendering {self.app_or_project} template files with filenames: {", ".join(self.extra_files)}\n'
+                f'Rendering {self.app_or_project} template files with filenames: {extra_files}\n'
             )
 
     def _prepare_new_path_file(self, filename, relative_dir, options):
@@ -193,10 +280,12 @@ class PatchedTemplateCommand(TemplateCommand):
         """
         new_path = path.join(self._top_dir_path, relative_dir, filename.replace(self.base_name, self.name))
 
-        for old_suffix, new_suffix in self.rewrite_template_suffixes:
-            if new_path.endswith(old_suffix):
-                new_path = new_path[:-len(old_suffix)] + new_suffix
-                break  # Only rewrite once
+        # большинство файлов шаблона не требует замены суффикса, поэтому сначала проверяются все суффиксы разом
+        if new_path.endswith(self._template_suffixes):
+            for old_suffix, new_suffix in self.rewrite_template_suffixes:
+                if new_path.endswith(old_suffix):
+                    new_path = new_path[:-len(old_suffix)] + new_suffix
+                    break  # Only rewrite once
 
         if path.exists(new_path):
             raise CommandError(
@@ -210,14 +299,22 @@ class PatchedTemplateCommand(TemplateCommand):
         # Only render the Python files, as we don't want to
         # accidentally render Django templates files
         if new_path.endswith(self.extensions) or filename in self.extra_files:
-            with open(old_path, 'r', encoding='utf-8') as template_file:
-                content = template_file.read()
-            template = Engine().from_string(content)
-            content = template.render(self.context)
-            with open(new_path, 'w', encoding='utf-8') as new_file:
-                if new_path.endswith('.py'):
-                    content = self._sort_imports(content)
+            template, specialized_render = self._compile_template(old_path)
+
+            content = None
+            if specialized_render and self.context_data is not None:
+                content = specialized_render(self.context_data)
 
+            if content is None:
+                # теги шаблона могут записывать значения в контекст, поэтому файл рендерится в отдельном слое контекста,
+                # не затрагивая общие для всех файлов данные
+                with self.context.push():
+                    content = template.render(self.context)
+
+            if new_path.endswith('.py'):
+                content = self._sort_imports(content)
+
+            with open(new_path, 'w', encoding='utf-8') as new_file:
                 new_file.write(content)
         else:
             shutil.copyfile(old_path, new_path)
@@ -225,8 +322,13 @@ class PatchedTemplateCommand(TemplateCommand):
         if self.verbosity >= 2:
             self.stdout.write("Creating %s\n" % new_path)
         try:
-            shutil.copymode(old_path, new_path)
-            self.make_writeable(new_path)
+            # права шаблона переносятся на созданный файл только при их отличии или при отсутствии у владельца права на
+            # запись
+            old_file_mode = stat.S_IMODE(os.stat(old_path).st_mode)
+            new_file_mode = stat.S_IMODE(os.stat(new_path).st_mode)
+            if old_file_mode != new_file_mode or not new_file_mode & stat.S_IWUSR:
+                shutil.copymode(old_path, new_path)
+                self.make_writeable(new_path)
         except OSError:
             self.stderr.write(
                 msg=(
@@ -240,12 +342,12 @@ class PatchedTemplateCommand(TemplateCommand):
         template_dir = str(self.handle_template())
         prefix_length = len(template_dir) + 1
 
-        template_dir_items = [(root, dirs, files) for root, dirs, files in os.walk(template_dir)]
+        is_template_dir_walked = False
+        files_to_render = []
 
-        if not template_dir_items:
-            raise CommandError('Please, check template directory, because directory is empty!')
-
-        for root, dirs, files in template_dir_items:
+        # обход производится лениво, чтобы исключение директорий из dirs влияло на дальнейший обход
+        for root, dirs, files in os.walk(template_dir):
+            is_template_dir_walked = True
 
             path_rest = root[prefix_length:]
             relative_dir = path_rest.replace(self.base_name, self.name)
@@ -254,9 +356,7 @@ class PatchedTemplateCommand(TemplateCommand):
                 if not path.exists(target_dir):
                     os.mkdir(target_dir)
 
-            for dirname in dirs[:]:
-                if dirname.startswith('.') or dirname == '__pycache__':
-                    dirs.remove(dirname)
+            dirs[:] = [dirname for dirname in dirs if not dirname.startswith('.') and dirname != '__pycache__']
 
             for filename in files:
                 if filename.endswith(('.pyo', '.pyc', '.py.class')):
@@ -266,13 +366,20 @@ class PatchedTemplateCommand(TemplateCommand):
 
                 new_path = self._prepare_new_path_file(filename, relative_dir, options)
 
-                self._render_file(new_path, old_path, filename)
+                files_to_render.append((new_path, old_path, filename))
 
-    def _prepare_context(self, options):
+        if not is_template_dir_walked:
+            raise CommandError('Please, check template directory, because directory is empty!')
+
+        # файлы создаются после обхода всего шаблона, чтобы уже существующие файлы обнаруживались до записи
+        for new_path, old_path, filename in files_to_render:
+            self._render_file(new_path, old_path, filename)
+
+    def _get_context_data(self, options) -> dict:
         """
-        Создание контекста
+        Формирование значений контекста рендеринга шаблонов
         """
-        self.context = Context({
+        return {
             **options,
             self.base_name: self.name,
             self.base_directory: self._top_dir_path,
@@ -280,7 +387,22 @@ class PatchedTemplateCommand(TemplateCommand):
             self.base_python_path: self._python_path_value,
             'docs_version': get_docs_version(),
             'django_version': django.__version__,
-        }, autoescape=False)
+        }
+
+    def _prepare_context(self, options):
+        """
+        Создание контекста
+        """
+        self.context_data = self._get_context_data(options)
+        # генерируется исходный код, поэтому значения выводятся как есть, без локализации и перевода во временную зону
+        self.context = Context(self.context_data, autoescape=False, use_l10n=False, use_tz=False)
+
+    def _prepare_isort_config(self):
+        """
+        Получение конфигурации isort из настроек проекта, используемой при сортировке импортов во всех генерируемых
+        файлах. При ее отсутствии используется конфигурация isort по умолчанию, загружаемая при первой сортировке
+        """
+        self._isort_config = getattr(settings, 'ISORT_CONFIG', None)
 
     def _django_setup(self):
         """
@@ -316,7 +438,7 @@ class PatchedTemplateCommand(TemplateCommand):
         self.base_directory = f'{app_or_project}_directory'
         self.base_python_path = f'{app_or_project}_python_path'
         self.camel_case_name = f'camel_case_{app_or_project}_name'
-        self.camel_case_value = ''.join(x for x in name.title() if x != '_')
+        self.camel_case_value = name.title().translate(_DROP_UNDERSCORE_TABLE)
         self.validate_name(name, app_or_project)
 
     def handle(self, app_or_project, name, target=None, **options):
@@ -329,6 +451,7 @@ class PatchedTemplateCommand(TemplateCommand):
         self._prepare_extra_files(options)
         self._prepare_extensions(options)
         self._prepare_context(options)
+        self._prepare_isort_config()
         self._create_package_by_template(options)
         self._remove_paths()
 
@@ -442,20 +565,14 @@ class Command(PatchedTemplateCommand):
         self.url_name = self.name.replace('_', '-')
         self.base_url_name = f'{app_or_project}_url_name'
 
-    def _prepare_context(self, options):
+    def _get_context_data(self, options) -> dict:
         """
-        Создание контекста
+        Формирование значений контекста рендеринга шаблонов
         """
-        self.context = Context({
-            **options,
-            self.base_name: self.name,
-            self.base_url_name: self.url_name,
-            self.base_directory: self._top_dir_path,
-            self.camel_case_name: self.camel_case_value,
-            self.base_python_path: self._python_path_value,
-            'docs_version': get_docs_version(),
-            'django_version': django.__version__,
-        }, autoescape=False)
+        context_data = super()._get_context_data(options)
+        context_data[self.base_url_name] = self.url_name
+
+        return context_data
 
     def handle(self, **options):
         function_name = options.pop('name')
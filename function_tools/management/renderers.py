@@ -0,0 +1,71 @@
+from typing import (
+    Callable,
+    Optional,
+)
+
+from django.template import (
+    Template,
+)
+from django.template.base import (
+    TextNode,
+    Variable,
+    VariableNode,
+)
+
+
+def _is_simple_variable_node(node) -> bool:
+    """
+    Проверка, является ли узел выводом переменной контекста без фильтров, точечных обращений и перевода
+    """
+    if not isinstance(node, VariableNode):
+        return False
+
+    filter_expression = node.filter_expression
+    variable = filter_expression.var
+
+    return (
+        not filter_expression.filters
+        and isinstance(variable, Variable)
+        and variable.lookups is not None
+        and len(variable.lookups) == 1
+        and not variable.translate
+    )
+
+
+def specialize_template(
+    template: Template,
+    name: str,
+) -> Optional[Callable[[dict], Optional[str]]]:
+    """
+    Формирование функции рендеринга шаблона, состоящего только из текста и простых переменных.
+
+    Сформированная функция собирает результат из текстовых фрагментов и строковых значений контекста без обхода
+    дерева узлов Django. Если значение переменной отсутствует или не является строкой, функция возвращает None, и шаблон
+    должен быть отрендерен штатно, т.к. результат Django в этом случае зависит от локализации и настроек движка.
+
+    :param template: разобранный шаблон
+    :param name: имя файла шаблона, используемое в трассировке ошибок
+    :return: функция рендеринга или None, если шаблон содержит теги, фильтры или сложные обращения к переменным
+    """
+    lines = ['def render(values):']
+    parts = []
+
+    for node in template.nodelist:
+        if isinstance(node, TextNode):
+            parts.append(repr(node.s))
+        elif _is_simple_variable_node(node):
+            value_name = f'value_{len(parts)}'
+            lines.append(f'    {value_name} = values.get({node.filter_expression.var.var!r})')
+            lines.append(f'    if {value_name}.__class__ is not str:')
+            lines.append('        return None')
+            parts.append(value_name)
+        else:
+            return None
+
+    joined_parts = ''.join(f'{part}, ' for part in parts)
+    lines.append(f"    return ''.join(({joined_parts}))")
+
+    namespace = {}
+    exec(compile('\n'.join(lines), f'<specialized template {name}>', 'exec'), namespace)
+
+    return namespace['render']